@@ -5,23 +5,51 @@ AnyRouter.top 自动签到脚本 (终极版)
 """
 
 import asyncio
-import hashlib
-import json
 import os
-import sys
 import random
+import sys
+from contextlib import AsyncExitStack
 from datetime import datetime
 
-import httpx
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
 
+from utils import waf_cache
+from utils.checkin_core import (
+    SharedBrowser,
+    WafCookiesRejectedError,
+    build_cookie_header,
+    build_user_info,
+    create_http_client,
+    execute_check_in,
+    generate_balance_hash,
+    get_provider_template,
+    get_user_info,
+    get_waf_cache_key,
+    has_inline_quota,
+    load_balance_hash,
+    parse_cookies,
+    prepare_cookies,
+    save_balance_hash,
+)
 from utils.config import AccountConfig, AppConfig, load_accounts_config
 from utils.notify import notify
 
 load_dotenv()
 
-BALANCE_HASH_FILE = 'balance_hash.txt'
+def load_max_concurrency(default: int = 4) -> int:
+    """读取同时处理的账号数上限，非法值回退到默认值，且至少为 1"""
+    try:
+        return max(1, int(os.getenv('MAX_CONCURRENCY') or default))
+    except ValueError:
+        print(f'[WARNING] Invalid MAX_CONCURRENCY, using default value {default}')
+        return default
+
+# 同时处理的账号数上限，避免账号过多时同时打开大量浏览器页面
+MAX_CONCURRENCY = load_max_concurrency()
+
+def is_force_notify() -> bool:
+    """FORCE_NOTIFY 为 1/true/yes (不区分大小写) 时强制发送通知，false/0 等其他值不生效"""
+    return os.getenv('FORCE_NOTIFY', '').strip().lower() in ('1', 'true', 'yes')
 
 # --- HTML 邮件模板 ---
 HTML_TEMPLATE = """
@@ -71,155 +99,64 @@ HTML_TEMPLATE = """
 </body>
 </html>
 """
+# 模板在导入时按占位符预先切分，生成报表时只需一次拼接
+_HTML_HEAD, _HTML_REST = HTML_TEMPLATE.split('{{DATE_TIME}}')
+_HTML_MIDDLE, _HTML_TAIL = _HTML_REST.split('{{TABLE_ROWS}}')
 
-def load_balance_hash():
-    """加载余额hash"""
-    try:
-        if os.path.exists(BALANCE_HASH_FILE):
-            with open(BALANCE_HASH_FILE, 'r', encoding='utf-8') as f:
-                return f.read().strip()
-    except Exception:
-        pass
-    return None
-
-def save_balance_hash(balance_hash):
-    """保存余额hash"""
-    try:
-        with open(BALANCE_HASH_FILE, 'w', encoding='utf-8') as f:
-            f.write(balance_hash)
-    except Exception as e:
-        print(f'Warning: Failed to save balance hash: {e}')
-
-def generate_balance_hash(balances):
-    """生成余额数据的hash"""
-    simple_balances = {k: v['quota'] for k, v in balances.items()} if balances else {}
-    balance_json = json.dumps(simple_balances, sort_keys=True, separators=(',', ':'))
-    return hashlib.sha256(balance_json.encode('utf-8')).hexdigest()[:16]
-
-def parse_cookies(cookies_data):
-    """解析 cookies 数据"""
-    if isinstance(cookies_data, dict):
-        return cookies_data
-    if isinstance(cookies_data, str):
-        cookies_dict = {}
-        for cookie in cookies_data.split(';'):
-            if '=' in cookie:
-                key, value = cookie.strip().split('=', 1)
-                cookies_dict[key] = value
-        return cookies_dict
-    return {}
-
-async def get_waf_cookies_with_playwright(account_name: str, login_url: str, required_cookies: list[str]):
-    """使用 Playwright 获取 WAF cookies"""
-    print(f'[PROCESSING] {account_name}: Starting browser to get WAF cookies...')
-    async with async_playwright() as p:
-        import tempfile
-        with tempfile.TemporaryDirectory() as temp_dir:
-            context = await p.chromium.launch_persistent_context(
-                user_data_dir=temp_dir,
-                headless=True,
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36',
-                viewport={'width': 1920, 'height': 1080},
-                args=['--disable-blink-features=AutomationControlled', '--no-sandbox']
-            )
-            page = await context.new_page()
-            try:
-                await page.goto(login_url, wait_until='networkidle')
-                try:
-                    await page.wait_for_function('document.readyState === "complete"', timeout=5000)
-                except Exception:
-                    await page.wait_for_timeout(3000)
-                
-                cookies = await page.context.cookies()
-                waf_cookies = {}
-                for cookie in cookies:
-                    if cookie.get('name') in required_cookies and cookie.get('value'):
-                        waf_cookies[cookie.get('name')] = cookie.get('value')
-                
-                await context.close()
-                return waf_cookies if waf_cookies else None
-            except Exception as e:
-                print(f'[FAILED] {account_name}: Error getting WAF cookies: {e}')
-                await context.close()
-                return None
-
-def get_user_info(client, headers, user_info_url: str):
-    """获取用户信息"""
-    try:
-        response = client.get(user_info_url, headers=headers, timeout=30)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('success'):
-                user_data = data.get('data', {})
-                quota = round(user_data.get('quota', 0) / 500000, 2)
-                used_quota = round(user_data.get('used_quota', 0) / 500000, 2)
-                return {
-                    'success': True,
-                    'quota': quota,
-                    'used_quota': used_quota,
-                    'display': f':money: Balance: ${quota}, Used: ${used_quota}',
-                }
-        return {'success': False, 'error': f'HTTP {response.status_code}'}
-    except Exception as e:
-        return {'success': False, 'error': str(e)[:50]}
-
-async def prepare_cookies(account_name: str, provider_config, user_cookies: dict) -> dict | None:
-    waf_cookies = {}
-    if provider_config.needs_waf_cookies():
-        login_url = f'{provider_config.domain}{provider_config.login_path}'
-        waf_cookies = await get_waf_cookies_with_playwright(account_name, login_url, provider_config.waf_cookie_names)
-        if not waf_cookies: return None
-    return {**waf_cookies, **user_cookies}
-
-def execute_check_in(client, account_name: str, provider_config, headers: dict):
-    """执行签到请求"""
-    checkin_headers = headers.copy()
-    checkin_headers.update({'Content-Type': 'application/json', 'X-Requested-With': 'XMLHttpRequest'})
-    sign_in_url = f'{provider_config.domain}{provider_config.sign_in_path}'
-    response = client.post(sign_in_url, headers=checkin_headers, timeout=30)
-    
-    if response.status_code == 200:
-        try:
-            result = response.json()
-            if result.get('ret') == 1 or result.get('code') == 0 or result.get('success'):
-                return True
-            print(f'[FAILED] {account_name}: {result.get("msg", "Unknown error")}')
-            return False
-        except:
-            return 'success' in response.text.lower()
-    return False
-
-async def check_in_account(account: AccountConfig, account_index: int, app_config: AppConfig):
+async def check_in_account(account: AccountConfig, account_index: int, app_config: AppConfig, semaphore: asyncio.Semaphore, shared_browser: SharedBrowser, client):
     """单账号处理：先签到 -> 后查余额"""
+    async with semaphore:
+        return await _check_in_account(account, account_index, app_config, shared_browser, client)
+
+async def _check_in_account(account: AccountConfig, account_index: int, app_config: AppConfig, shared_browser: SharedBrowser, client):
     account_name = account.get_display_name(account_index)
     print(f'\n[PROCESSING] {account_name}...')
     
     provider_config = app_config.get_provider(account.provider)
-    if not provider_config: return False, None
-
-    user_cookies = parse_cookies(account.cookies)
-    all_cookies = await prepare_cookies(account_name, provider_config, user_cookies)
-    if not all_cookies: return False, None
+    if not provider_config:
+        print(f'[FAILED] {account_name}: Provider "{account.provider}" not found in configuration')
+        return False, None
 
-    client = httpx.Client(http2=True, timeout=30.0)
     try:
-        client.cookies.update(all_cookies)
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36',
-            'Referer': provider_config.domain,
-            'Origin': provider_config.domain,
+        user_cookies = parse_cookies(account.cookies)
+        all_cookies = await prepare_cookies(client, shared_browser, account_name, provider_config, user_cookies)
+        if not all_cookies: return False, None
+
+        sign_in_url, user_info_url, base_headers, checkin_headers = get_provider_template(
+            provider_config.domain, provider_config.sign_in_path, provider_config.user_info_path
+        )
+        account_headers = {
+            'Cookie': build_cookie_header(all_cookies),
             provider_config.api_user_key: account.api_user,
         }
 
         # 1. 签到
-        check_in_success = True
+        check_in_success, check_in_data = True, None
         if provider_config.needs_manual_check_in():
-            check_in_success = execute_check_in(client, account_name, provider_config, headers)
-            if check_in_success: await asyncio.sleep(1) # 等待数据同步
+            try:
+                check_in_success, check_in_data = await execute_check_in(
+                    client, account_name, sign_in_url, {**checkin_headers, **account_headers}
+                )
+            except WafCookiesRejectedError as e:
+                # 缓存的 WAF cookies 可能已失效，清除缓存后重新获取并重试一次
+                print(f'[INFO] {account_name}: Check-in rejected ({e}), refreshing WAF cookies...')
+                waf_cache.invalidate(get_waf_cache_key(provider_config))
+                all_cookies = await prepare_cookies(client, shared_browser, account_name, provider_config, user_cookies)
+                if not all_cookies: return False, None
+                account_headers['Cookie'] = build_cookie_header(all_cookies)
+                try:
+                    check_in_success, check_in_data = await execute_check_in(
+                        client, account_name, sign_in_url, {**checkin_headers, **account_headers}
+                    )
+                except WafCookiesRejectedError as e:
+                    print(f'[FAILED] {account_name}: Check-in rejected again ({e})')
+                    return False, {'success': False, 'error': str(e)}
         
-        # 2. 查余额
-        user_info_url = f'{provider_config.domain}{provider_config.user_info_path}'
-        user_info = get_user_info(client, headers, user_info_url)
+        # 2. 查余额 (签到响应已带余额时直接使用，省去一次请求)
+        if check_in_success and has_inline_quota(check_in_data):
+            user_info = build_user_info(check_in_data)
+        else:
+            user_info = await get_user_info(client, {**base_headers, **account_headers}, user_info_url)
         
         if user_info and user_info.get('success'):
             print(f"[INFO] {account_name} {user_info['display']}")
@@ -228,63 +165,102 @@ async def check_in_account(account: AccountConfig, account_index: int, app_confi
     except Exception as e:
         print(f'[FAILED] {account_name}: {e}')
         return False, None
-    finally:
-        client.close()
 
 def generate_html_report(results):
     """生成美观的 HTML 邮件内容"""
-    rows = ""
+    rows = []
+    append_row = rows.append
     for res in results:
         status_class = "status-success" if res['success'] else "status-fail"
         status_text = "✅ 签到成功" if res['success'] else "❌ 签到失败"
         quota = f"${res.get('quota', 0)}" if res.get('quota') is not None else "-"
         used = f"${res.get('used', 0)}" if res.get('used') is not None else "-"
         
-        rows += f"""
+        append_row(f"""
         <tr>
           <td>{res['name']}</td>
           <td><span class="{status_class}">{status_text}</span></td>
           <td class="balance">{quota}</td>
           <td class="balance" style="color: #64748b;">{used}</td>
         </tr>
-        """
+        """)
     
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    return HTML_TEMPLATE.replace("{{DATE_TIME}}", current_time).replace("{{TABLE_ROWS}}", rows)
+    return "".join((_HTML_HEAD, current_time, _HTML_MIDDLE, *rows, _HTML_TAIL))
 
 def write_github_summary(results):
     """生成 GitHub Action 摘要"""
     if not os.getenv('GITHUB_STEP_SUMMARY'): return
-    markdown = "### 🚀 AnyRouter 签到结果汇总\n\n| 账号 | 状态 | 余额 | 已用 | 备注 |\n| :--- | :---: | :---: | :---: | :--- |\n"
+    lines = ["### 🚀 AnyRouter 签到结果汇总\n\n| 账号 | 状态 | 余额 | 已用 | 备注 |\n| :--- | :---: | :---: | :---: | :--- |\n"]
     for res in results:
         icon = "✅" if res['success'] else "❌"
         quota = f"${res.get('quota', '-')}"
         used = f"${res.get('used', '-')}"
-        markdown += f"| {res['name']} | {icon} | {quota} | {used} | {res.get('msg', '')} |\n"
+        lines.append(f"| {res['name']} | {icon} | {quota} | {used} | {res.get('msg', '')} |\n")
     try:
-        with open(os.getenv('GITHUB_STEP_SUMMARY'), 'a', encoding='utf-8') as f: f.write(markdown)
+        with open(os.getenv('GITHUB_STEP_SUMMARY'), 'a', encoding='utf-8') as f: f.write("".join(lines))
     except: pass
 
+def may_need_browser(accounts: list[AccountConfig], app_config: AppConfig) -> bool:
+    """是否有账号需要 WAF cookies 且没有可用缓存 (此时才值得提前启动浏览器)"""
+    for account in accounts:
+        provider_config = app_config.get_provider(account.provider)
+        if provider_config and provider_config.needs_waf_cookies() and not waf_cache.get(get_waf_cache_key(provider_config)):
+            return True
+    return False
+
+async def cancel_and_wait(task: asyncio.Task):
+    """取消尚未完成的任务并等待其结束，只忽略任务自身的结果 (外部的取消/中断照常传播)"""
+    task.cancel()
+    await asyncio.wait([task])
+    if not task.cancelled():
+        # 读取异常，避免出现 "Task exception was never retrieved" 警告
+        task.exception()
+
 async def main():
     print('[SYSTEM] AnyRouter Auto Check-in Started')
     
-    # === 随机延迟 (模拟真人) ===
-    # 0 到 30分钟 随机延迟
-    delay = random.randint(1, 600)
-    print(f'[WAIT] Random delay: {delay} seconds...')
-    await asyncio.sleep(delay)
-    
     app_config = AppConfig.load_from_env()
     accounts = load_accounts_config()
     if not accounts: sys.exit(1)
 
     summary_results = []
     text_notify_lines = []
+    current_balances = {}
     success_count = 0
 
-    for i, account in enumerate(accounts):
+    # 浏览器和 HTTP client 统一由 AsyncExitStack 管理，退出时按相反顺序关闭
+    async with AsyncExitStack() as stack:
+        # 所有账号共享同一个浏览器 (仅在需要时启动)，每个账号只新建轻量的上下文
+        shared_browser = SharedBrowser(stack)
+        if may_need_browser(accounts, app_config):
+            # 延迟期间并行预热浏览器；启动失败由 SharedBrowser 记录，只影响真正需要浏览器的账号
+            browser_task = asyncio.create_task(shared_browser.get())
+            # 在 sleep 之前注册清理，延迟被取消时也不会遗留未等待的任务
+            stack.push_async_callback(cancel_and_wait, browser_task)
+
+        # === 随机延迟 (模拟真人) ===
+        # 1 秒到 10 分钟随机延迟
+        delay = random.randint(1, 600)
+        print(f'[WAIT] Random delay: {delay} seconds...')
+        await asyncio.sleep(delay)
+        # 所有账号共享同一个 HTTP client，复用到同一域名的连接
+        client = await stack.enter_async_context(create_http_client())
+
+        # 并发处理所有账号，由信号量限制同时运行的数量
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+        results = await asyncio.gather(
+            *[check_in_account(account, i, app_config, semaphore, shared_browser, client) for i, account in enumerate(accounts)],
+            return_exceptions=True,
+        )
+
+    for i, (account, result) in enumerate(zip(accounts, results)):
         account_name = account.get_display_name(i)
-        success, user_info = await check_in_account(account, i, app_config)
+        if isinstance(result, BaseException):
+            print(f'[FAILED] {account_name}: {result}')
+            success, user_info = False, None
+        else:
+            success, user_info = result
         
         if success: success_count += 1
         
@@ -294,7 +270,7 @@ async def main():
             'success': success,
             'quota': user_info.get('quota') if user_info else None,
             'used': user_info.get('used_quota') if user_info else None,
-            'msg': 'OK' if success else user_info.get('error', 'Unknown Error')
+            'msg': 'OK' if success else (user_info or {}).get('error', 'Unknown Error')
         }
         summary_results.append(res)
         
@@ -302,6 +278,7 @@ async def main():
         status_icon = '[SUCCESS]' if success else '[FAIL]'
         line = f"{status_icon} {account_name}"
         if user_info and user_info.get('success'):
+            current_balances[account_name] = {'quota': res['quota'], 'used': res['used']}
             line += f"\n💰 余额: ${res['quota']} (已用: ${res['used']})"
         elif user_info:
             line += f"\n⚠️ {res['msg']}"
@@ -309,37 +286,43 @@ async def main():
 
     # 1. 生成 GitHub 摘要
     write_github_summary(summary_results)
+
+    # 2. 全部成功且余额无变化时跳过通知 (FORCE_NOTIFY=true 可强制发送)
+    current_balance_hash = generate_balance_hash(current_balances)
+    last_balance_hash = load_balance_hash()
+    save_balance_hash(current_balance_hash)
+    if success_count == len(accounts) and current_balance_hash == last_balance_hash and not is_force_notify():
+        print('[INFO] No balance change; skipping notifications')
+        sys.exit(0)
     
-    # 2. 发送通知
+    # 3. 发送通知 (各渠道互相独立，并发发送)
+    notifications = []
     # A. 专门给邮箱发 HTML 报表 (如果配置了邮箱)
     if os.getenv('EMAIL_USER'):
-        print('[NOTIFY] Sending HTML report to email...')
         html_content = generate_html_report(summary_results)
-        try:
-            notify.send_email("AnyRouter 签到日报", html_content, msg_type='html')
-        except Exception as e:
-            print(f'[ERROR] Failed to send email: {e}')
+        notifications.append(('Email', notify.send_email, ("AnyRouter 签到日报", html_content, 'html')))
 
     # B. 给其他渠道 (钉钉/TG等) 发纯文本
-    # 注意：这里我们过滤掉 'Email' 以免发两遍 (一遍HTML一遍Text)
-    # 但由于 notify.push_message 比较简单，我们手动处理一下
-    
+    # 注意：这里不使用 notify.push_message，以免邮箱再收到一封纯文本邮件
     full_text = f"📅 时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n" + "\n\n".join(text_notify_lines)
-    
-    # 简单的分发逻辑：如果配置了其他Webhook，手动发送
-    # 这里我们还是调用 push_message，但如果你配置了邮箱，push_message 也会再发一封纯文本邮件
-    # 如果你不介意收到两封邮件（一封HTML表格，一封纯文本），可以直接保留下面这行：
-    # notify.push_message('AnyRouter 签到结果', full_text, msg_type='text')
-    
-    # 稍微优化一下：手动触发除 Email 外的通知
-    print('[NOTIFY] Sending text notification to other channels...')
-    if os.getenv('DINGDING_WEBHOOK'): notify.send_dingtalk('AnyRouter', full_text)
-    if os.getenv('TELEGRAM_BOT_TOKEN'): notify.send_telegram('AnyRouter', full_text)
-    if os.getenv('FEISHU_WEBHOOK'): notify.send_feishu('AnyRouter', full_text)
-    if os.getenv('WEIXIN_WEBHOOK'): notify.send_wecom('AnyRouter', full_text)
-    if os.getenv('PUSHPLUS_TOKEN'): notify.send_pushplus('AnyRouter', full_text)
+    if os.getenv('DINGDING_WEBHOOK'): notifications.append(('DingTalk', notify.send_dingtalk, ('AnyRouter', full_text)))
+    if os.getenv('TELEGRAM_BOT_TOKEN'): notifications.append(('Telegram', notify.send_telegram, ('AnyRouter', full_text)))
+    if os.getenv('FEISHU_WEBHOOK'): notifications.append(('Feishu', notify.send_feishu, ('AnyRouter', full_text)))
+    if os.getenv('WEIXIN_WEBHOOK'): notifications.append(('WeChat Work', notify.send_wecom, ('AnyRouter', full_text)))
+    if os.getenv('PUSHPLUS_TOKEN'): notifications.append(('PushPlus', notify.send_pushplus, ('AnyRouter', full_text)))
     # ... 其他渠道可以按需添加 ...
 
+    if notifications:
+        print(f'[NOTIFY] Sending notifications to {len(notifications)} channel(s)...')
+        notify_results = await asyncio.gather(
+            *[asyncio.to_thread(func, *args) for _, func, args in notifications], return_exceptions=True
+        )
+        for (name, _, _), result in zip(notifications, notify_results):
+            if isinstance(result, BaseException):
+                print(f'[ERROR] [{name}]: Message push failed! Reason: {result}')
+            else:
+                print(f'[{name}]: Message push successful!')
+
     sys.exit(0 if success_count > 0 else 1)
 
 def run_main():
@@ -0,0 +1,142 @@
+import asyncio
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import httpx
+import pytest
+
+# 添加项目根目录到 PATH
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import checkin
+from utils.config import AccountConfig, AppConfig, ProviderConfig
+
+
+@pytest.mark.parametrize('value, expected', [('8', 8), ('0', 1), ('-2', 1), ('abc', 4), ('', 4)])
+def test_load_max_concurrency(monkeypatch, value, expected):
+	monkeypatch.setenv('MAX_CONCURRENCY', value)
+
+	assert checkin.load_max_concurrency() == expected
+
+
+@pytest.mark.parametrize(
+	'value, expected',
+	[('true', True), ('TRUE', True), ('1', True), ('yes', True), ('false', False), ('0', False), ('', False)],
+)
+def test_is_force_notify(monkeypatch, value, expected):
+	monkeypatch.setenv('FORCE_NOTIFY', value)
+
+	assert checkin.is_force_notify() is expected
+
+
+@pytest.fixture
+def waf_provider(tmp_path, monkeypatch):
+	monkeypatch.setattr(checkin.waf_cache, 'CACHE_DIR', str(tmp_path / '.waf_cache'))
+	provider_config = ProviderConfig(
+		name='test', domain='https://example.com', bypass_method='waf_cookies', waf_cookie_names=['acw_tc']
+	)
+	checkin.waf_cache.set(checkin.get_waf_cache_key(provider_config), {'acw_tc': 'stale'})
+	return provider_config
+
+
+def run_check_in_account(provider_config, sign_in_status, session='abc'):
+	"""sign_in_status(cookie_header) 返回签到接口的状态码，记录签到请求次数"""
+	sign_in_calls = []
+
+	def handler(request):
+		if request.url.path == '/login':
+			return httpx.Response(200, headers={'set-cookie': 'acw_tc=fresh; Path=/'})
+		if request.url.path == '/api/user/sign_in':
+			sign_in_calls.append(request.headers.get('cookie'))
+			status = sign_in_status(request.headers.get('cookie', ''))
+			return httpx.Response(status, json={'ret': 1} if status == 200 else {})
+		status = 401 if 'session=expired' in request.headers.get('cookie', '') else 200
+		return httpx.Response(status, json={'success': True, 'data': {'quota': 1000000, 'used_quota': 0}})
+
+	async def run():
+		async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+			account = AccountConfig(cookies={'session': session}, api_user='1', provider='test')
+			app_config = AppConfig(providers={'test': provider_config})
+			return await checkin._check_in_account(account, 0, app_config, MagicMock(), client)
+
+	return asyncio.run(run()), sign_in_calls
+
+
+def test_check_in_refreshes_rejected_waf_cookies(waf_provider):
+	(success, user_info), sign_in_calls = run_check_in_account(
+		waf_provider, lambda cookie: 403 if 'acw_tc=stale' in cookie else 200
+	)
+
+	assert success
+	assert user_info['success']
+	assert len(sign_in_calls) == 2
+	assert checkin.waf_cache.get(checkin.get_waf_cache_key(waf_provider)) == {'acw_tc': 'fresh'}
+
+
+def test_check_in_reports_repeated_waf_rejection(waf_provider):
+	(success, user_info), sign_in_calls = run_check_in_account(waf_provider, lambda cookie: 403)
+
+	assert not success
+	assert user_info == {'success': False, 'error': 'HTTP 403'}
+	assert len(sign_in_calls) == 2
+
+
+def test_check_in_unauthorized_keeps_waf_cache(waf_provider):
+	(success, user_info), sign_in_calls = run_check_in_account(waf_provider, lambda cookie: 401, session='expired')
+
+	assert not success
+	assert user_info == {'success': False, 'error': 'HTTP 401'}
+	assert len(sign_in_calls) == 1
+	assert checkin.waf_cache.get(checkin.get_waf_cache_key(waf_provider)) == {'acw_tc': 'stale'}
+
+
+def test_may_need_browser_only_without_cached_waf_cookies(waf_provider):
+	accounts = [AccountConfig(cookies={'session': 'abc'}, api_user='1', provider='test')]
+	app_config = AppConfig(providers={'test': waf_provider})
+
+	assert not checkin.may_need_browser(accounts, app_config)
+	checkin.waf_cache.invalidate(checkin.get_waf_cache_key(waf_provider))
+	assert checkin.may_need_browser(accounts, app_config)
+
+
+def test_cancel_and_wait_cleans_up_pending_and_failed_tasks():
+	async def fail():
+		raise RuntimeError('launch failed')
+
+	async def run():
+		pending = asyncio.create_task(asyncio.sleep(3600))
+		failed = asyncio.create_task(fail())
+		await asyncio.sleep(0)
+		await checkin.cancel_and_wait(pending)
+		await checkin.cancel_and_wait(failed)
+		return pending, failed
+
+	pending, failed = asyncio.run(run())
+	assert pending.cancelled()
+	assert isinstance(failed.exception(), RuntimeError)
+
+
+def test_cancel_and_wait_propagates_outer_cancellation():
+	async def run():
+		started = asyncio.Event()
+
+		async def slow_launch():
+			started.set()
+			try:
+				await asyncio.sleep(3600)
+			except asyncio.CancelledError:
+				# 模拟浏览器关闭需要一点时间，期间外层任务被取消
+				await asyncio.sleep(0.05)
+
+		inner = asyncio.create_task(slow_launch())
+		await started.wait()
+		outer = asyncio.create_task(checkin.cancel_and_wait(inner))
+		await asyncio.sleep(0)
+		outer.cancel()
+		with pytest.raises(asyncio.CancelledError):
+			await outer
+		await asyncio.wait([inner])
+
+	asyncio.run(run())
@@ -0,0 +1,235 @@
+import asyncio
+import sys
+from contextlib import AsyncExitStack
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+import httpx
+import pytest
+
+# 添加项目根目录到 PATH
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils import checkin_core
+from utils.checkin_core import execute_check_in, generate_balance_hash, get_user_info, has_inline_quota, parse_cookies
+from utils.config import ProviderConfig
+
+
+def test_parse_cookies_string():
+	cookies = parse_cookies('session=abc=; acw_tc=123 ;data={"a": 1}')
+
+	assert cookies == {'session': 'abc=', 'acw_tc': '123', 'data': '{"a": 1}'}
+
+
+def test_parse_cookies_dict():
+	assert parse_cookies({'session': 'abc'}) == {'session': 'abc'}
+
+
+def test_generate_balance_hash():
+	balances = {'Account 1': {'quota': 1.5, 'used': 2}, 'Account 2': {'quota': 3, 'used': 0}}
+	reordered = {'Account 2': {'quota': 3, 'used': 1}, 'Account 1': {'quota': 1.5, 'used': 2}}
+
+	assert len(generate_balance_hash(balances)) == 16
+	assert generate_balance_hash(balances) == generate_balance_hash(reordered)
+	assert generate_balance_hash(balances) != generate_balance_hash({'Account 1': {'quota': 1.5}})
+
+
+def test_get_user_info():
+	def handler(request):
+		return httpx.Response(200, json={'success': True, 'data': {'quota': 1000000, 'used_quota': 250000}})
+
+	async def run():
+		async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+			return await get_user_info(client, {}, 'https://example.com/api/user/self')
+
+	user_info = asyncio.run(run())
+
+	assert user_info['success']
+	assert user_info['quota'] == 2.0
+	assert user_info['used_quota'] == 0.5
+
+
+def test_execute_check_in_returns_inline_data():
+	def handler(request):
+		return httpx.Response(200, json={'success': True, 'data': {'quota': 1000000, 'used_quota': 0}})
+
+	async def run():
+		async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+			return await execute_check_in(client, 'Account 1', 'https://example.com/api/user/sign_in', {})
+
+	success, data = asyncio.run(run())
+
+	assert success
+	assert has_inline_quota(data)
+	assert not has_inline_quota({'quota': 1000000})
+
+
+@pytest.mark.parametrize(
+	'data',
+	[
+		{'quota': None, 'used_quota': None},
+		{'quota': '1000000', 'used_quota': 0},
+		{'quota': True, 'used_quota': 0},
+		None,
+	],
+)
+def test_has_inline_quota_rejects_non_numeric_values(data):
+	assert not has_inline_quota(data)
+
+
+class FakePlaywright:
+	def __init__(self, launch_error=None):
+		self.launch_count = 0
+		self.launch_error = launch_error
+		self.chromium = self
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *args):
+		pass
+
+	async def launch(self, **kwargs):
+		self.launch_count += 1
+		await asyncio.sleep(0)
+		if self.launch_error:
+			raise self.launch_error
+		return MagicMock(close=AsyncMock())
+
+
+def test_shared_browser_launches_once(monkeypatch):
+	playwright = FakePlaywright()
+	monkeypatch.setattr(checkin_core, 'async_playwright', lambda: playwright)
+
+	async def run():
+		async with AsyncExitStack() as stack:
+			shared_browser = checkin_core.SharedBrowser(stack)
+			browsers = await asyncio.gather(*[shared_browser.get() for _ in range(3)])
+		return browsers
+
+	browsers = asyncio.run(run())
+
+	assert playwright.launch_count == 1
+	assert browsers[0] is browsers[1] is browsers[2]
+	browsers[0].close.assert_awaited_once()
+
+
+def test_shared_browser_not_launched_when_unused(monkeypatch):
+	playwright = FakePlaywright()
+	monkeypatch.setattr(checkin_core, 'async_playwright', lambda: playwright)
+
+	async def run():
+		async with AsyncExitStack() as stack:
+			checkin_core.SharedBrowser(stack)
+
+	asyncio.run(run())
+
+	assert playwright.launch_count == 0
+
+
+def test_shared_browser_launch_failure(monkeypatch):
+	playwright = FakePlaywright(launch_error=RuntimeError('chromium not installed'))
+	monkeypatch.setattr(checkin_core, 'async_playwright', lambda: playwright)
+
+	async def run():
+		async with AsyncExitStack() as stack:
+			shared_browser = checkin_core.SharedBrowser(stack)
+			for _ in range(2):
+				with pytest.raises(RuntimeError, match='chromium not installed'):
+					await shared_browser.get()
+
+	asyncio.run(run())
+
+	assert playwright.launch_count == 1
+
+
+def test_prepare_cookies_launch_failure_only_fails_account(monkeypatch, tmp_path):
+	playwright = FakePlaywright(launch_error=RuntimeError('chromium not installed'))
+	monkeypatch.setattr(checkin_core, 'async_playwright', lambda: playwright)
+	monkeypatch.setattr(checkin_core.waf_cache, 'CACHE_DIR', str(tmp_path))
+	provider_config = ProviderConfig(
+		name='test', domain='https://example.com', bypass_method='waf_cookies', waf_cookie_names=['acw_tc']
+	)
+
+	async def run():
+		async with AsyncExitStack() as stack:
+			shared_browser = checkin_core.SharedBrowser(stack)
+			async with httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200))) as client:
+				return await checkin_core.prepare_cookies(
+					client, shared_browser, 'Account 1', provider_config, {'session': 'abc'}
+				)
+
+	assert asyncio.run(run()) is None
+
+
+def test_prepare_cookies_does_not_cache_partial_waf_cookies(monkeypatch, tmp_path):
+	monkeypatch.setattr(checkin_core.waf_cache, 'CACHE_DIR', str(tmp_path))
+	monkeypatch.setattr(checkin_core, 'get_waf_cookies_with_playwright', AsyncMock(return_value={'acw_tc': 'abc'}))
+	provider_config = ProviderConfig(
+		name='test',
+		domain='https://example.com',
+		bypass_method='waf_cookies',
+		waf_cookie_names=['acw_tc', 'acw_sc__v2'],
+	)
+	shared_browser = MagicMock(get=AsyncMock())
+
+	async def run():
+		async with httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200))) as client:
+			return await checkin_core.prepare_cookies(
+				client, shared_browser, 'Account 1', provider_config, {'session': 'abc'}
+			)
+
+	assert asyncio.run(run()) == {'acw_tc': 'abc', 'session': 'abc'}
+	assert checkin_core.waf_cache.get(checkin_core.get_waf_cache_key(provider_config)) is None
+
+
+def run_get_waf_cookies_with_http(handler, required_cookies):
+	async def run():
+		async with checkin_core.create_http_client(transport=httpx.MockTransport(handler)) as client:
+			result = await checkin_core.get_waf_cookies_with_http(
+				client, 'Account 1', 'https://example.com/login', required_cookies
+			)
+			return result, list(client.cookies.jar)
+
+	return asyncio.run(run())
+
+
+def test_get_waf_cookies_with_http_follows_redirects_with_cookies():
+	def handler(request):
+		if request.url.path == '/login':
+			return httpx.Response(302, headers={'set-cookie': 'acw_tc=abc; Path=/', 'location': '/challenge'})
+		# 只有带上前一跳设置的 cookie 才会下发第二个 cookie
+		if 'acw_tc=abc' in request.headers.get('cookie', ''):
+			return httpx.Response(200, headers={'set-cookie': 'cdn_sec_tc=def; Path=/'})
+		return httpx.Response(200)
+
+	waf_cookies, client_cookies = run_get_waf_cookies_with_http(handler, ['acw_tc', 'cdn_sec_tc'])
+
+	assert waf_cookies == {'acw_tc': 'abc', 'cdn_sec_tc': 'def'}
+	assert client_cookies == []
+
+
+def test_get_waf_cookies_with_http_missing_cookie():
+	def handler(request):
+		return httpx.Response(200, headers={'set-cookie': 'acw_tc=abc; Path=/'})
+
+	waf_cookies, _ = run_get_waf_cookies_with_http(handler, ['acw_tc', 'cdn_sec_tc'])
+
+	assert waf_cookies is None
+
+
+def test_get_waf_cookies_with_http_redirect_loop():
+	def handler(request):
+		return httpx.Response(302, headers={'set-cookie': 'acw_tc=abc; Path=/', 'location': '/login'})
+
+	waf_cookies, _ = run_get_waf_cookies_with_http(handler, ['acw_tc'])
+
+	assert waf_cookies is None
+
+
+@pytest.mark.parametrize('value, expected', [('60', 60), ('0', 0), ('-5', 0), ('abc', 1800), ('', 1800)])
+def test_load_waf_cache_ttl(monkeypatch, value, expected):
+	monkeypatch.setenv('WAF_CACHE_TTL', value)
+
+	assert checkin_core.load_waf_cache_ttl() == expected
@@ -0,0 +1,47 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# 添加项目根目录到 PATH
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils import waf_cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+	monkeypatch.setattr(waf_cache, 'CACHE_DIR', str(tmp_path / '.waf_cache'))
+
+
+def test_make_key_ignores_cookie_order():
+	key = waf_cache.make_key('https://anyrouter.top', ['acw_tc', 'cdn_sec_tc'])
+
+	assert key == waf_cache.make_key('https://anyrouter.top', ['cdn_sec_tc', 'acw_tc'])
+	assert key != waf_cache.make_key('https://agentrouter.org', ['acw_tc', 'cdn_sec_tc'])
+
+
+def test_set_and_get():
+	waf_cache.set('key', {'acw_tc': 'value'})
+
+	assert waf_cache.get('key') == {'acw_tc': 'value'}
+
+
+def test_get_missing():
+	assert waf_cache.get('missing') is None
+
+
+def test_get_expired(monkeypatch):
+	waf_cache.set('key', {'acw_tc': 'value'}, ttl=60)
+	monkeypatch.setattr(waf_cache.time, 'time', lambda: 10**12)
+
+	assert waf_cache.get('key') is None
+
+
+def test_invalidate():
+	waf_cache.set('key', {'acw_tc': 'value'})
+	waf_cache.invalidate('key')
+	waf_cache.invalidate('key')
+
+	assert waf_cache.get('key') is None
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+签到核心逻辑模块
+"""
+
+import asyncio
+import functools
+import hashlib
+import os
+from contextlib import AsyncExitStack
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from types import MappingProxyType
+
+import httpx
+import orjson
+from playwright.async_api import async_playwright
+
+from utils import waf_cache
+
+BALANCE_HASH_FILE = 'balance_hash.txt'
+MAX_WAF_REDIRECTS = 10
+USER_AGENT = (
+	'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36'
+)
+
+
+class WafCookiesRejectedError(Exception):
+	"""WAF cookies 被服务端拒绝 (HTTP 403)"""
+
+
+class SharedBrowser:
+	"""所有账号共享的 Playwright 浏览器，首次需要时才启动，关闭操作注册到 AsyncExitStack"""
+
+	def __init__(self, stack: AsyncExitStack):
+		self._stack = stack
+		self._lock = asyncio.Lock()
+		self._browser = None
+		self._error: Exception | None = None
+
+	async def get(self):
+		"""获取浏览器，启动失败时抛出异常 (失败后不再重复启动)"""
+		async with self._lock:
+			if self._browser is None and self._error is None:
+				try:
+					playwright = await self._stack.enter_async_context(async_playwright())
+					self._browser = await playwright.chromium.launch(
+						headless=True, args=['--disable-blink-features=AutomationControlled', '--no-sandbox']
+					)
+					self._stack.push_async_callback(self._browser.close)
+				except Exception as e:
+					self._error = e
+			if self._error is not None:
+				raise self._error
+			return self._browser
+
+
+class _RejectAllCookiePolicy(DefaultCookiePolicy):
+	"""共享 client 不保存响应 cookies，各账号的 cookies 通过请求头单独传递，避免串号"""
+
+	def set_ok(self, cookie, request):
+		return False
+
+
+def create_http_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+	"""创建所有账号共享的 HTTP client，复用连接池"""
+	return httpx.AsyncClient(
+		http2=True,
+		timeout=30.0,
+		limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+		cookies=CookieJar(policy=_RejectAllCookiePolicy()),
+		transport=transport,
+	)
+
+
+def build_cookie_header(cookies: dict) -> str:
+	return '; '.join(f'{key}={value}' for key, value in cookies.items())
+
+
+@functools.lru_cache(maxsize=None)
+def get_provider_template(domain: str, sign_in_path: str | None, user_info_path: str):
+	"""按 provider 预先构建 URL 和公共请求头 (只读)，同一 provider 的所有账号共享"""
+	base_headers = {'User-Agent': USER_AGENT, 'Referer': domain, 'Origin': domain}
+	checkin_headers = {**base_headers, 'Content-Type': 'application/json', 'X-Requested-With': 'XMLHttpRequest'}
+	return (
+		f'{domain}{sign_in_path}',
+		f'{domain}{user_info_path}',
+		MappingProxyType(base_headers),
+		MappingProxyType(checkin_headers),
+	)
+
+
+def load_balance_hash():
+	"""加载余额hash"""
+	try:
+		if os.path.exists(BALANCE_HASH_FILE):
+			with open(BALANCE_HASH_FILE, 'r', encoding='utf-8') as f:
+				return f.read().strip()
+	except Exception:
+		pass
+	return None
+
+
+def save_balance_hash(balance_hash):
+	"""保存余额hash"""
+	try:
+		with open(BALANCE_HASH_FILE, 'w', encoding='utf-8') as f:
+			f.write(balance_hash)
+	except Exception as e:
+		print(f'Warning: Failed to save balance hash: {e}')
+
+
+@functools.lru_cache(maxsize=None)
+def _hash_balance_items(balance_items: tuple) -> str:
+	balance_json = orjson.dumps(dict(balance_items), option=orjson.OPT_SORT_KEYS)
+	return hashlib.blake2b(balance_json, digest_size=8).hexdigest()
+
+
+def generate_balance_hash(balances):
+	"""生成余额数据的hash"""
+	balance_items = tuple(sorted((k, v['quota']) for k, v in balances.items())) if balances else ()
+	return _hash_balance_items(balance_items)
+
+
+def parse_cookies(cookies_data):
+	"""解析 cookies 数据"""
+	if isinstance(cookies_data, dict):
+		return cookies_data
+	if isinstance(cookies_data, str):
+		# 不用 http.cookies.SimpleCookie：遇到含空格/引号/JSON 的值会静默丢弃后续所有 cookie
+		return dict(cookie.strip().split('=', 1) for cookie in cookies_data.split(';') if '=' in cookie)
+	return {}
+
+
+# 获取 WAF cookies 不需要渲染页面，拦截这些资源以减少流量和渲染开销
+BLOCKED_RESOURCE_TYPES = frozenset({'image', 'font', 'stylesheet', 'media'})
+
+
+async def block_heavy_resources(route):
+	if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+		await route.abort()
+	else:
+		await route.continue_()
+
+
+async def get_waf_cookies_with_playwright(browser, account_name: str, login_url: str, required_cookies: list[str]):
+	"""使用 Playwright 获取 WAF cookies (共享浏览器，每个账号独立的无痕上下文)"""
+	print(f'[PROCESSING] {account_name}: Opening browser context to get WAF cookies...')
+	required_set = set(required_cookies)
+	try:
+		async with AsyncExitStack() as stack:
+			context = await browser.new_context(user_agent=USER_AGENT, viewport={'width': 1920, 'height': 1080})
+			stack.push_async_callback(context.close)
+			page = await context.new_page()
+			await page.route('**/*', block_heavy_resources)
+			await page.goto(login_url, wait_until='domcontentloaded')
+			# WAF cookies 通常在首个响应或挑战脚本执行后即写入，拿齐后立即返回，无需等待网络空闲
+			for _ in range(20):
+				cookies = await context.cookies()
+				if required_set <= {cookie['name'] for cookie in cookies}:
+					break
+				await page.wait_for_timeout(150)
+
+			waf_cookies = {c['name']: c['value'] for c in cookies if c.get('name') in required_set and c.get('value')}
+
+			return waf_cookies if waf_cookies else None
+	except Exception as e:
+		print(f'[FAILED] {account_name}: Error getting WAF cookies: {e}')
+		return None
+
+
+def build_user_info(user_data: dict) -> dict:
+	"""根据接口返回的用户数据生成余额信息"""
+	quota = round(user_data.get('quota', 0) / 500000, 2)
+	used_quota = round(user_data.get('used_quota', 0) / 500000, 2)
+	return {
+		'success': True,
+		'quota': quota,
+		'used_quota': used_quota,
+		'display': f':money: Balance: ${quota}, Used: ${used_quota}',
+	}
+
+
+def has_inline_quota(data: dict | None) -> bool:
+	"""签到响应中是否已直接带有可用的余额数据 (均为数值，null 等值需回退到查询接口)"""
+	if not isinstance(data, dict):
+		return False
+	return all(
+		isinstance(data.get(key), (int, float)) and not isinstance(data.get(key), bool)
+		for key in ('quota', 'used_quota')
+	)
+
+
+async def get_user_info(client, headers, user_info_url: str):
+	"""获取用户信息"""
+	try:
+		response = await client.get(user_info_url, headers=headers, timeout=30)
+		if response.status_code == 200:
+			data = orjson.loads(response.content)
+			if data.get('success'):
+				return build_user_info(data.get('data', {}))
+		return {'success': False, 'error': f'HTTP {response.status_code}'}
+	except Exception as e:
+		return {'success': False, 'error': str(e)[:50]}
+
+
+async def get_waf_cookies_with_http(client, account_name: str, login_url: str, required_cookies: list[str]):
+	"""直接请求登录页获取 WAF cookies，全部拿到时无需启动浏览器"""
+	# 共享 client 不保存 cookies，这里用本次调用独有的 cookie jar 手动跟随重定向，
+	# 使前面跳转中设置的 cookies 能带到后续请求 (WAF 常见的“先种 cookie 再跳转”)
+	cookies = httpx.Cookies()
+	url = login_url
+	try:
+		for _ in range(MAX_WAF_REDIRECTS + 1):
+			request = client.build_request('GET', url, headers={'User-Agent': USER_AGENT}, timeout=30)
+			cookies.set_cookie_header(request)
+			response = await client.send(request)
+			cookies.extract_cookies(response)
+			if response.next_request is None:
+				break
+			url = response.next_request.url
+		else:
+			raise httpx.TooManyRedirects('Exceeded maximum allowed redirects.', request=request)
+	except Exception as e:
+		print(f'[INFO] {account_name}: Direct request for WAF cookies failed: {e}')
+		return None
+
+	required_set = set(required_cookies)
+	waf_cookies = {cookie.name: cookie.value for cookie in cookies.jar if cookie.name in required_set and cookie.value}
+
+	# waf_cookies 是 dict，成员判断为 O(1)
+	missing_cookies = [name for name in required_cookies if name not in waf_cookies]
+	if missing_cookies:
+		print(f'[INFO] {account_name}: Missing WAF cookies via direct request: {missing_cookies}')
+		return None
+	print(f'[INFO] {account_name}: Got WAF cookies via direct request, skipping browser')
+	return waf_cookies
+
+
+def load_waf_cache_ttl() -> int:
+	"""读取 WAF cookies 缓存有效期 (秒)，非法值回退到默认值，且不小于 0"""
+	try:
+		return max(0, int(os.getenv('WAF_CACHE_TTL') or waf_cache.DEFAULT_TTL))
+	except ValueError:
+		print(f'[WARNING] Invalid WAF_CACHE_TTL, using default value {waf_cache.DEFAULT_TTL}')
+		return waf_cache.DEFAULT_TTL
+
+
+def get_waf_cache_key(provider_config) -> str:
+	return waf_cache.make_key(provider_config.domain, provider_config.waf_cookie_names)
+
+
+async def prepare_cookies(
+	client, shared_browser: SharedBrowser, account_name: str, provider_config, user_cookies: dict
+) -> dict | None:
+	waf_cookies = {}
+	if provider_config.needs_waf_cookies():
+		cache_key = get_waf_cache_key(provider_config)
+		waf_cookies = waf_cache.get(cache_key)
+		if waf_cookies:
+			print(f'[INFO] {account_name}: Using cached WAF cookies')
+			return {**waf_cookies, **user_cookies}
+
+		login_url = f'{provider_config.domain}{provider_config.login_path}'
+		waf_cookies = await get_waf_cookies_with_http(client, account_name, login_url, provider_config.waf_cookie_names)
+		if not waf_cookies:
+			try:
+				browser = await shared_browser.get()
+			except Exception as e:
+				print(f'[FAILED] {account_name}: Failed to launch browser: {e}')
+				return None
+			waf_cookies = await get_waf_cookies_with_playwright(
+				browser, account_name, login_url, provider_config.waf_cookie_names
+			)
+		if not waf_cookies:
+			return None
+		# 浏览器轮询超时时可能只拿到部分 cookies，这种结果只用于本次，不写入缓存供其他账号复用
+		if set(provider_config.waf_cookie_names) <= waf_cookies.keys():
+			waf_cache.set(cache_key, waf_cookies, ttl=load_waf_cache_ttl())
+	return {**waf_cookies, **user_cookies}
+
+
+async def execute_check_in(client, account_name: str, sign_in_url: str, headers: dict) -> tuple[bool, dict | None]:
+	"""执行签到请求，返回 (是否成功, 响应中的 data 字段)"""
+	response = await client.post(sign_in_url, headers=headers, timeout=30)
+
+	# 401 通常是账号 session 失效，与 WAF 无关，只有 403 才视为 WAF cookies 被拒绝
+	if response.status_code == 403:
+		raise WafCookiesRejectedError(f'HTTP {response.status_code}')
+	if response.status_code == 200:
+		try:
+			result = orjson.loads(response.content)
+			if result.get('ret') == 1 or result.get('code') == 0 or result.get('success'):
+				return True, result.get('data')
+			print(f'[FAILED] {account_name}: {result.get("msg", "Unknown error")}')
+			return False, None
+		except Exception:
+			return 'success' in response.text.lower(), None
+	return False, None
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+WAF cookies 缓存模块
+
+按 provider 将 WAF cookies 缓存到本地文件，有效期内的运行可直接复用，无需再次获取
+"""
+
+import hashlib
+import json
+import os
+import time
+
+CACHE_DIR = '.waf_cache'
+DEFAULT_TTL = 1800
+
+
+def make_key(domain: str, cookie_names: list[str]) -> str:
+	"""根据 provider 域名和所需 cookie 名称生成缓存 key"""
+	raw = domain + ',' + ','.join(sorted(cookie_names))
+	return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _cache_path(key: str) -> str:
+	return os.path.join(CACHE_DIR, f'{key}.json')
+
+
+def get(key: str) -> dict | None:
+	"""读取未过期的缓存 cookies，不存在或已过期时返回 None"""
+	try:
+		with open(_cache_path(key), 'r', encoding='utf-8') as f:
+			entry = json.load(f)
+		if time.time() - entry['ts'] < entry.get('ttl', DEFAULT_TTL):
+			return entry['cookies']
+	except Exception:
+		pass
+	return None
+
+
+def set(key: str, cookies: dict, ttl: int = DEFAULT_TTL):
+	"""写入缓存 cookies"""
+	try:
+		os.makedirs(CACHE_DIR, exist_ok=True)
+		with open(_cache_path(key), 'w', encoding='utf-8') as f:
+			json.dump({'ts': time.time(), 'ttl': ttl, 'cookies': cookies}, f)
+	except Exception as e:
+		print(f'[WARNING] Failed to save WAF cookies cache: {e}')
+
+
+def invalidate(key: str):
+	"""删除缓存 cookies"""
+	try:
+		os.remove(_cache_path(key))
+	except FileNotFoundError:
+		pass
+	except Exception as e:
+		print(f'[WARNING] Failed to remove WAF cookies cache: {e}')